@@ -23,9 +23,9 @@ USAGE:
 
 
     async def test_get_proxy():
-        proxy_generator = Proxy()
-        proxy = await proxy_generator.get_proxy()
-        print(f"Proxy: {proxy}")
+        async with Proxy() as proxy_generator:
+            proxy = await proxy_generator.get_proxy()
+            print(f"Proxy: {proxy}")
 
     asyncio.run(test_get_proxy())
     
@@ -41,21 +41,69 @@ Time Complexity Justification:
 import os 
 import aiohttp
 import json
+import ijson
 from dotenv import load_dotenv
 import random 
 import diskcache
 from collections import deque  
+from itertools import islice
 import asyncio
+import time
+import logging
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class Proxy:
 
-    def __init__(self, batch_size: int = 1000, cache_expiry: int = 60 * 60 * 24):
+    def __init__(self, batch_size: int = 1000, cache_expiry: int = 60 * 60 * 24, concurrency: int = 100, blocked_hosts: tuple[str, ...] = ('172.67.', '172.64.')):
         self.cache = diskcache.Cache(os.path.join('cache', 'proxy_cache'))
         self.proxy_url: str = os.environ.get('PROXY_LIST_HTTP', None) # replace with proxy json url, for example "https://cdn.jsdelivr.net/gh/proxifly/free-proxy-list@main/proxies/countries/US/data.json" for all US proxies
         self.batch_size = batch_size
         self.cache_expiry = cache_expiry
+        # host prefixes to skip (cloudflare edge servers by default), matched against the host so a port containing 172.67 isn't dropped.
+        # startswith with a tuple compares each prefix in turn (4 schemes x len(blocked_hosts)), cheap C level compares at this size
+        self._blocked_prefixes = tuple(f"{scheme}://{host}" for scheme in ('http', 'https', 'socks4', 'socks5') for host in blocked_hosts)
+        self._concurrency = concurrency # max number of proxies tested at the same time
+        self._max_good_proxies = 16 # size of the LRU of recently working proxies checked before fetching a new list
+        self._max_fetch_retries = 2 # refetches of the proxy list allowed when it comes back empty
+        self._probe_timeout = aiohttp.ClientTimeout(total=3, connect=2) # fail fast on proxies that never accept the connection
+        self._session: aiohttp.ClientSession | None = None # shared across all requests, created lazily in _get_session
+        # in memory copy of http_proxies_requested as (expire_time, proxy_list), reloaded only when the version key changes
+        self._proxy_list_mem: tuple[float | None, list] | None = None
+        self._proxy_list_version: int = -1
+        # in memory copy of the bad:<proxy> keys, reloaded only when bad_proxies_version changes
+        self._bad_cache: set[str] = set()
+        self._bad_version: int = -1
+
+    async def __aenter__(self) -> "Proxy":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Returns the shared session, creating it on first use so the connector and DNS cache are shared between proxy tests.
+
+        returns:
+            aiohttp.ClientSession: The session used for every request made by this instance.
+        """
+        if self._session is None or self._session.closed:
+            # probes are one-shot connections to a different proxy each time, so close sockets instead of pooling dead ones
+            connector = aiohttp.TCPConnector(limit=self._concurrency, limit_per_host=4, force_close=True, ttl_dns_cache=60)
+            # no session wide timeout, the proxy list download can take longer, probes pass self._probe_timeout instead
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def aclose(self) -> None:
+        """
+        Close the shared session, if one was opened.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     async def get_proxy(self) -> str | None:
         """
@@ -69,157 +117,251 @@ class Proxy:
             str | None: A working proxy URL or None if no working proxy is found.
         """
 
-        if self.cache.get('working_proxy') is not None:
-            cached_proxy = self.cache.get('working_proxy')
-            print("Using cached proxy.")
-            # check if the cached proxy is still valid
-            async with aiohttp.ClientSession() as session:
-                _, is_working = await self._test_single_proxy(session, cached_proxy)
-                if is_working:
-                    print("Cached proxy is working.")
-                    return cached_proxy
-                else:
-                    print("Cached proxy is not working, fetching a new one.")
-                    self.cache.delete('working_proxy')
+        good_proxies = self.cache.get('good_proxies')
+        if good_proxies:
+            logger.debug("Using %s cached proxies.", len(good_proxies))
+            # check the recently working proxies concurrently, failures are only evicted, not cached as bad
+            proxy = await self._test_proxy_batch(list(good_proxies), cache_bad=False)
+            if proxy is not None:
+                logger.debug("Cached proxy is working.")
+                return proxy
+            logger.debug("No cached proxy is working, fetching a new one.")
             
         proxy = await self._fetch_proxy()
         return proxy
 
-    async def _fetch_proxy(self) -> str | None:
+    async def _fetch_proxy(self, retries: int = 0) -> str | None:
         """
         fetch_proxy called from get_proxy, excecuted when the cache fails to return a working proxy.
 
+        params:
+            retries (int): Number of times the proxy list has already been refetched because it was empty.
+
         returns:
             str | None: A working proxy URL or None if no working proxy is found.
         """
 
         if self.proxy_url == None:
-            print("No proxy URL provided.")
+            logger.warning("No proxy URL provided.")
             return None
         
-        async with aiohttp.ClientSession() as session:
-            all_proxies = None
-            proxy_list = []
-
-            if self.cache.get('http_proxies_requested') is None:
-                async with session.get(self.proxy_url) as response:
-                    response_json = await response.json()
-
-                    proxy_list = [
-                        f"{proxy['proxy']}" for proxy in response_json 
-                        if not ('172.67' in proxy['proxy'] or '172.64' in proxy['proxy'])
-                        ] # there is cloudflare edge servers in the mix, therefore it will not work, thus filter, this took way too long to debug
-                    
-                    # Filter out known bad proxies
-                    bad_proxies = self.cache.get('bad_proxies', set())
-                    proxy_list = [proxy for proxy in proxy_list if proxy not in bad_proxies]
-
-                    # if no proxies are found then deleete the cache
-                    if len(proxy_list) == 0:
-                        print("No valid proxies found, clearing cache.")
-                        self.cache.delete('http_proxies_requested')
-                        self.get_proxy()  # Retry to fetch proxies
-                    
-                    # Shuffle 
-                    # random.shuffle(proxy_list)
+        session = await self._get_session()
+        all_proxies = None
+        proxy_list = []
+
+        cached_proxies = self._get_cached_proxy_list()
+        if cached_proxies is None:
+            bad_proxies = self._get_bad_proxies()
+            async with session.get(self.proxy_url) as response:
+                # stream the json and filter as it arrives instead of buffering the whole document first,
+                # only the proxy field is pulled out so the rest of each entry is never built into a dict
+                async for proxy in ijson.items_async(response.content, 'item.proxy'):
+                    if proxy.startswith(self._blocked_prefixes):
+                        continue # there is cloudflare edge servers in the mix, therefore it will not work, thus filter, this took way too long to debug
+                    if proxy in bad_proxies:
+                        continue # Filter out known bad proxies
+                    proxy_list.append(proxy)
                 
-                    all_proxies = deque(proxy_list[0:self.batch_size])
-                    
-                    # Cache the proxy list for future use
-                    self.cache.set('http_proxies_requested', proxy_list, expire=self.cache_expiry)
-            else:
-                cached_proxies = self.cache.get('http_proxies_requested')
-                bad_proxies = self.cache.get('bad_proxies', set())
-                filtered_proxies = [proxy for proxy in cached_proxies if proxy not in bad_proxies]
-                all_proxies = deque(filtered_proxies[0:self.batch_size])
-                proxy_list = filtered_proxies
-
-            print(f"Proxies found: {len(all_proxies)}/{len(proxy_list)}")
-
-            max_attempts = min(self.batch_size, len(all_proxies)) # choose the minimum of batch size and available proxies to avoid overflow
-            attempts = 0
+                # Shuffle 
+                # random.shuffle(proxy_list)
             
-            #test in batch size 
-            if len(all_proxies) >= self.batch_size:
-                proxy = await self._test_proxy_batch(all_proxies)
-                if proxy:
-                    return proxy
-
-
-            while len(all_proxies) > 0 and attempts < max_attempts:
+                all_proxies = deque(islice(proxy_list, self.batch_size))
+                
+                # Cache the proxy list for future use
+                await asyncio.to_thread(self._set_cached_proxy_list, proxy_list)
+        else:
+            filtered_proxies = self._filter_bad_proxies(cached_proxies)
+            all_proxies = deque(islice(filtered_proxies, self.batch_size))
+            proxy_list = filtered_proxies
+
+        # if no proxies are found then delete the cache and refetch, bounded so an empty upstream list can't loop forever
+        if len(proxy_list) == 0:
+            if retries < self._max_fetch_retries:
+                logger.debug("No valid proxies found, clearing cache.")
+                await asyncio.to_thread(self._set_cached_proxy_list, None)
+                return await self._fetch_proxy(retries + 1)  # Retry to fetch proxies
+            logger.debug("No valid proxies found.")
+            return None
 
-                proxy = all_proxies.popleft()  
-                attempts += 1
+        logger.debug("Proxies found: %s/%s", len(all_proxies), len(proxy_list))
 
-                print(f"Testing proxy {attempts}/{max_attempts}: {proxy}")
+        # every proxy in the batch is tested concurrently (bounded by the semaphore), so there is nothing left to retry serially
+        proxy = await self._test_proxy_batch(all_proxies)
+        if proxy:
+            return proxy
 
-                _ , is_working = await self._test_single_proxy(session, proxy)
-                
-                if is_working :
-                    print(f"Proxy {proxy} is working.")
-                    self.cache.set('working_proxy', proxy)
-                    return proxy
-                else:
-                    print(f"Proxy {proxy} failed.")
-                    self._cache_bad_proxy(proxy)
-
-            print("Max attempts reached or no more proxies available.")
+        logger.debug("No working proxy found in this batch.")
         return None
 
-    async def _test_proxy_batch(self, proxy_list: list) -> str | None:
+    async def _test_proxy_batch(self, proxy_list: list, cache_bad: bool = True) -> str | None:
         """
         Test multiple proxies concurrently and return the first working one.
+
+        params:
+            proxy_list (list): Proxies to test.
+            cache_bad (bool): Whether failed proxies are cached as bad so they aren't tested again.
+
+        returns:
+            str | None: The first working proxy or None if none of them work.
         """
-        timeout = aiohttp.ClientTimeout(total=3) # timeout so it doesn't hang forever
+        session = await self._get_session()
+        sem = asyncio.Semaphore(self._concurrency)
+
+        async def guarded(proxy: str) -> tuple[str, bool]:
+            async with sem:
+                return await self._test_single_proxy(session, proxy)
+
+        # Create tasks up front, the semaphore keeps only self._concurrency of them connecting at once
+        tasks = [asyncio.create_task(guarded(proxy)) for proxy in proxy_list]
+        working = None
+        failed = []
         
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            # Create tasks without awaiting them
-            tasks = [self._test_single_proxy(session, proxy) for proxy in proxy_list]
-            
+        try:
             # Use asyncio.as_completed to get results as they come in
             for coroutine in asyncio.as_completed(tasks):
                 try:
                     proxy, is_working = await coroutine
                     if is_working:
-                        print(f"Working proxy found: {proxy}")
-                        self.cache.set('working_proxy', proxy)
-                        return proxy
+                        logger.info("Working proxy found: %s", proxy)
+                        working = proxy
+                        break
                     else:
-                        # Cache the bad proxy so we don't test it again
-                        self._cache_bad_proxy(proxy)
+                        failed.append(proxy)
                 except Exception as e:
                     continue
-        return None
+        finally:
+            # tear down any in-flight connections once we have a result
+            for task in tasks:
+                task.cancel()
+
+        # write the results once per batch in a worker thread so the sqlite writes don't block the event loop
+        if cache_bad and failed:
+            # Cache the bad proxies so we don't test them again
+            await asyncio.to_thread(self._cache_bad_proxies, failed)
+        await asyncio.to_thread(self._update_good_proxies, working, failed)
+        return working
         
     async def _test_single_proxy(self, session: aiohttp.ClientSession, proxy: str) -> tuple[str, bool]:
         """
         Test a single proxy using the provided session and return proxy and result.
         """
         try:
-            async with session.get('https://httpbin.org/ip', proxy=proxy) as response:
-                if response.status == 200:
-                    return proxy, True
+            # HEAD over plain http, we only need the status line so skip the TLS handshake and the body
+            response = await session.head('http://httpbin.org/status/200', proxy=proxy, allow_redirects=False, timeout=self._probe_timeout)
+            try:
+                is_working = response.status == 200
+            finally:
+                # release straight away, only the status is needed so there is no body worth waiting for
+                response.release()
+            return proxy, is_working
         except Exception:
             pass
         
         return proxy, False
     
-    def _cache_bad_proxy(self, bad_proxy: str) -> None:
+    def _get_cached_proxy_list(self) -> list | None:
+        """
+        Return the cached proxy list, only unpickling it from disk when another write has happened since it was last loaded.
+
+        returns:
+            list | None: The cached proxy list or None if it is missing or expired.
+        """
+        with self.cache.transact():
+            version = self.cache.get('http_proxies_requested_version', 0)
+            if version != self._proxy_list_version or self._proxy_list_mem is None:
+                proxy_list, expire_time = self.cache.get('http_proxies_requested', expire_time=True)
+                self._proxy_list_mem = (expire_time, proxy_list) if proxy_list is not None else None
+                self._proxy_list_version = version
+
+        if self._proxy_list_mem is None:
+            return None
+
+        expire_time, proxy_list = self._proxy_list_mem
+        if expire_time is not None and expire_time <= time.time():
+            self._proxy_list_mem = None
+            return None
+        return proxy_list
+
+    def _set_cached_proxy_list(self, proxy_list: list | None) -> None:
+        """
+        Write the proxy list to the cache (or delete it when proxy_list is None) and bump its version so other instances reload it.
+        """
+        # write and version bump in one transaction so another writer can't slip its list in between
+        with self.cache.transact():
+            if proxy_list is None:
+                self.cache.delete('http_proxies_requested')
+            else:
+                self.cache.set('http_proxies_requested', proxy_list, expire=self.cache_expiry)
+            self._proxy_list_version = self.cache.incr('http_proxies_requested_version')
+        self._proxy_list_mem = (time.time() + self.cache_expiry, proxy_list) if proxy_list is not None else None
+
+    def _update_good_proxies(self, working: str | None = None, failed: list | None = None) -> None:
+        """
+        Update the LRU of recently working proxies, moving working to the front and evicting any failed ones.
+        """
+        with self.cache.transact():
+            good_proxies = self.cache.get('good_proxies') or deque(maxlen=self._max_good_proxies)
+            evicted = [proxy for proxy in failed or () if proxy in good_proxies]
+            if working is None and not evicted:
+                return
+
+            for proxy in evicted:
+                good_proxies.remove(proxy)
+            if working is not None:
+                if working in good_proxies:
+                    good_proxies.remove(working)
+                good_proxies.appendleft(working)
+            self.cache.set('good_proxies', good_proxies)
+
+    def _cache_bad_proxies(self, bad_proxies: list) -> None:
         """
-        Cache a non-working proxy so it won't be tested again.
+        Cache non-working proxies so they won't be tested again, all in a single transaction.
         """
-        bad_proxies = self.cache.get('bad_proxies', set())
-        bad_proxies.add(bad_proxy)
+        # one key per proxy so each is a single O(1) write instead of rewriting the whole set
         # Cache bad proxies permanently (no expiry)
-        self.cache.set('bad_proxies', bad_proxies)
+        with self.cache.transact():
+            for bad_proxy in bad_proxies:
+                self.cache.set(f"bad:{bad_proxy}", True)
+            version = self.cache.incr('bad_proxies_version')
+
+        # if nobody else wrote since our last load the in memory set stays current, otherwise it is reloaded on next use
+        if version == self._bad_version + 1:
+            self._bad_cache.update(bad_proxies)
+            self._bad_version = version
+
+    def _get_bad_proxies(self) -> set[str]:
+        """
+        Return the set of cached bad proxies, only reloading it from disk when bad_proxies_version has changed.
+        """
+        with self.cache.transact():
+            version = self.cache.get('bad_proxies_version', 0)
+            if version != self._bad_version:
+                self._bad_cache = {key[4:] for key in self.cache.iterkeys() if isinstance(key, str) and key.startswith('bad:')}
+                self._bad_version = version
+        return self._bad_cache
+
+    def _filter_bad_proxies(self, proxy_list: list) -> list:
+        """
+        Return the proxies from proxy_list that have not been cached as bad.
+        """
+        bad_proxies = self._get_bad_proxies()
+        return [proxy for proxy in proxy_list if proxy not in bad_proxies]
     
 
 if __name__ == '__main__':
-    import asyncio
+    logging.basicConfig(level=logging.INFO)
 
     async def test_get_proxy():
-        proxy_generator = Proxy()
-        proxy = await proxy_generator.get_proxy()
-        print(f"Proxy: {proxy}")
-
-    asyncio.run(test_get_proxy())
+        async with Proxy() as proxy_generator:
+            proxy = await proxy_generator.get_proxy()
+            print(f"Proxy: {proxy}")
+
+    try:
+        import uvloop
+    except ImportError:
+        uvloop = None # uvloop isn't available on windows, fall back to the default loop
+
+    if uvloop is not None:
+        uvloop.run(test_get_proxy()) # libuv based loop, cheaper scheduling for the batch of proxy tests
+    else:
+        asyncio.run(test_get_proxy())